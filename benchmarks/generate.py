@@ -0,0 +1,162 @@
+"""Deterministic generator of synthetic PAL logs.
+
+The generated entries try to resemble a real shared log: a handful of authors and
+projects concentrate most of the activity (Zipf-like distributions), entries are
+spread over a period of time and a fraction of them are already reported.
+
+It can also be used on its own to create a populated DB for manual testing:
+
+    python -m benchmarks.generate /tmp/pal.db -n 100000
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import itertools
+import pathlib
+import random
+import sqlite3
+from dataclasses import dataclass
+from typing import Iterator
+
+from pal import cli, db
+from pal.utils import dates
+
+DEFAULT_SEED = 42
+DEFAULT_BATCH_SIZE = 10_000
+
+WORDS = (
+    "fixed added removed refactored reviewed deployed tested documented migrated "
+    "investigated bug feature release pipeline cache query index schema endpoint "
+    "dashboard meeting design report CLI parser config docs tests build the a for in "
+    "with from new old slow flaky broken legacy API DB service client"
+).split()
+
+
+@dataclass(frozen=True)
+class LogShape:
+    """Describe the distributions used to generate a synthetic log"""
+
+    n_authors: int = 50
+    n_projects: int = 200
+    reported_ratio: float = 0.7
+    span_days: int = 365 * 3
+    min_words: int = 3
+    max_words: int = 25
+    skew: float = 1.2
+
+
+def zipf_weights(n: int, skew: float) -> list[float]:
+    """Return `n` Zipf-like weights, so that the rank `k` has weight `1 / k**skew`"""
+    return [1 / (k**skew) for k in range(1, n + 1)]
+
+
+def author_name(i: int) -> str:
+    return f"author{i:03d}"
+
+
+def project_name(i: int) -> str:
+    return f"project{i:03d}"
+
+
+def generate_rows(
+    n: int, *, seed: int = DEFAULT_SEED, shape: LogShape = LogShape()
+) -> Iterator[tuple]:
+    """Generate `n` rows ready to be inserted in the `entry` table.
+
+    The rows are generated lazily, and the same `seed` and `shape` always produce
+    the same rows (the timestamps are relative to a fixed date, not to now).
+    """
+    rng = random.Random(seed)
+    authors = [author_name(i) for i in range(shape.n_authors)]
+    projects = [project_name(i) for i in range(shape.n_projects)]
+    author_weights = list(itertools.accumulate(zipf_weights(len(authors), shape.skew)))
+    project_weights = list(
+        itertools.accumulate(zipf_weights(len(projects), shape.skew))
+    )
+
+    # Like `pal commit`, the `timestamp` is naive and the `created_at` is aware
+    tz = dates.local_timezone()
+    end = datetime.datetime(2023, 1, 1)
+    span_seconds = shape.span_days * 24 * 3600
+
+    for _ in range(n):
+        author = rng.choices(authors, cum_weights=author_weights)[0]
+        project = rng.choices(projects, cum_weights=project_weights)[0]
+        n_words = rng.randint(shape.min_words, shape.max_words)
+        text = " ".join(rng.choices(WORDS, k=n_words)).capitalize()
+        timestamp = end - datetime.timedelta(
+            seconds=rng.randrange(span_seconds), microseconds=rng.randrange(10**6)
+        )
+        created_at = timestamp.replace(tzinfo=tz) + datetime.timedelta(
+            seconds=rng.randrange(60)
+        )
+        reported = rng.random() < shape.reported_ratio
+        yield (text, author, project, timestamp, reported, created_at, created_at)
+
+
+def populate(
+    con: sqlite3.Connection,
+    n: int,
+    *,
+    seed: int = DEFAULT_SEED,
+    shape: LogShape = LogShape(),
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Insert `n` synthetic entries into the `entry` table of `con`.
+
+    The `entry` table must already exist. Returns the number of inserted rows.
+    """
+    query = (
+        "INSERT INTO entry(text, author, project, timestamp, reported, created_at, "
+        "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    )
+    rows = generate_rows(n, seed=seed, shape=shape)
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        with con:
+            con.executemany(query, batch)
+        inserted += len(batch)
+    return inserted
+
+
+def create_log(
+    path: str | pathlib.Path,
+    n: int,
+    *,
+    seed: int = DEFAULT_SEED,
+    shape: LogShape = LogShape(),
+) -> pathlib.Path:
+    """Create a new PAL DB at `path` with `n` synthetic entries"""
+    path = pathlib.Path(path)
+    if path.exists():
+        path.unlink()
+    con = db.get_connection(path)
+    try:
+        cli.init_db(con)
+        populate(con, n, seed=seed, shape=shape)
+    finally:
+        con.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PAL log")
+    parser.add_argument("path", help="Path of the DB file to create (overwritten)")
+    parser.add_argument(
+        "-n", "--rows", help="Number of entries to generate", type=int, default=1000
+    )
+    parser.add_argument(
+        "--seed", help="Seed for the generator", type=int, default=DEFAULT_SEED
+    )
+    args = parser.parse_args()
+
+    path = create_log(args.path, args.rows, seed=args.seed)
+    print(f"{args.rows} entries written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,608 @@
+"""Benchmark the PAL CLI handlers and entry model functions at several log sizes.
+
+Every benchmark runs end to end against a real SQLite file populated with the
+synthetic log from `benchmarks.generate`. Each log size is generated once and
+copied before every benchmark (and before every repetition for the ones that
+modify the log), so all the measurements start from the same state.
+
+Usage:
+
+    python -m benchmarks.run run --sizes 1000 10000 100000 1000000
+    python -m benchmarks.run compare benchmarks/results/abc1234.json new.json
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+
+from benchmarks import generate
+from pal import __version__, cli, db, setup
+from pal.models import entry
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (not available on Windows)
+    resource = None  # type: ignore
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_REPEAT = 5
+DEFAULT_RESULTS_DIR = pathlib.Path(__file__).parent / "results"
+DEFAULT_THRESHOLD = 0.2
+
+
+@dataclass
+class Context:
+    """State shared by the benchmarks of a single log size"""
+
+    db_path: pathlib.Path
+    template: pathlib.Path
+    author: str
+    project: str
+    entry_id: int
+    con: Optional[sqlite3.Connection] = None
+
+
+@dataclass
+class Benchmark:
+    name: str
+    func: Callable[[Context], object]
+    # Whether the benchmark modifies the log, so it needs a fresh copy on every run
+    mutates: bool = False
+    # Whether the benchmark needs an open connection to the log in `Context.con`
+    needs_connection: bool = False
+
+
+@dataclass
+class Result:
+    name: str
+    size: int
+    times: list[float] = field(default_factory=list)
+    # Peak of the Python allocations (excluding SQLite's own memory)
+    peak_memory: int = 0
+    # Maximum resident set size of a child process running only this benchmark,
+    # and how much it grew while running it (including SQLite's own memory)
+    max_rss: Optional[int] = None
+    rss_growth: Optional[int] = None
+
+    def to_json(self) -> dict:
+        result = asdict(self)
+        result["min"] = min(self.times)
+        result["median"] = statistics.median(self.times)
+        result["mean"] = statistics.mean(self.times)
+        return result
+
+
+BENCHMARKS = [
+    # CLI handlers (including setup, DB initialization and output)
+    Benchmark(
+        "cli.handle_commit",
+        lambda ctx: cli.handle_commit(
+            "Benchmark entry", author=ctx.author, project=ctx.project
+        ),
+        mutates=True,
+    ),
+    Benchmark(
+        "cli.handle_log",
+        lambda ctx: cli.handle_log(author=ctx.author, project=ctx.project),
+    ),
+    Benchmark(
+        "cli.handle_log[json]",
+        lambda ctx: cli.handle_log(author=ctx.author, project=ctx.project, json=True),
+    ),
+    Benchmark(
+        "cli.handle_log[include_reported]",
+        lambda ctx: cli.handle_log(
+            author=ctx.author, project=ctx.project, include_reported=True
+        ),
+    ),
+    Benchmark(
+        "cli.handle_log[json,include_reported]",
+        lambda ctx: cli.handle_log(
+            author=ctx.author, project=ctx.project, json=True, include_reported=True
+        ),
+    ),
+    Benchmark(
+        "cli.handle_report",
+        lambda ctx: cli.handle_report(
+            author=ctx.author, project=ctx.project, auto_yes=True
+        ),
+        mutates=True,
+    ),
+    Benchmark(
+        "cli.handle_report[all]",
+        lambda ctx: cli.handle_report(
+            author=ctx.author, project=None, all=True, auto_yes=True
+        ),
+        mutates=True,
+    ),
+    Benchmark(
+        "cli.handle_clean",
+        lambda ctx: cli.handle_clean(
+            author=ctx.author, project=ctx.project, all=False, auto_yes=True
+        ),
+        mutates=True,
+    ),
+    Benchmark(
+        "cli.handle_clean[all]",
+        lambda ctx: cli.handle_clean(
+            author=ctx.author, project=None, all=True, auto_yes=True
+        ),
+        mutates=True,
+    ),
+    # Without sleeping between the steps, to measure the backup itself
+    Benchmark(
+        "cli.handle_backup",
+        lambda ctx: cli.handle_backup(str(ctx.db_path.with_name("backup.db")), sleep=0),
+    ),
+    Benchmark(
+        "cli.handle_backup[compress]",
+        lambda ctx: cli.handle_backup(
+            str(ctx.db_path.with_name("backup.db.gz")), compress=True, sleep=0
+        ),
+    ),
+    # With the default throttling, as run by the users (mostly sleeping)
+    Benchmark(
+        "cli.handle_backup[throttled]",
+        lambda ctx: cli.handle_backup(str(ctx.db_path.with_name("backup.db"))),
+    ),
+    Benchmark(
+        "cli.handle_restore",
+        lambda ctx: cli.handle_restore(str(ctx.template), auto_yes=True),
+        mutates=True,
+    ),
+    # Entry model functions
+    Benchmark(
+        "entry.insert_entry",
+        lambda ctx: entry.insert_entry(
+            ctx.con,  # type: ignore
+            entry.Entry(
+                text="Benchmark entry",
+                author=ctx.author,
+                project=ctx.project,
+                timestamp=datetime.datetime.now(),
+            ),
+        ),
+        mutates=True,
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.find_by_id",
+        lambda ctx: entry.find_by_id(ctx.con, ctx.entry_id),  # type: ignore
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.find_by_rowid",
+        lambda ctx: entry.find_by_rowid(ctx.con, ctx.entry_id),  # type: ignore
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.find_entries",
+        lambda ctx: entry.find_entries(
+            ctx.con, author=ctx.author, project=ctx.project  # type: ignore
+        ),
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.find_entries[include_reported]",
+        lambda ctx: entry.find_entries(
+            ctx.con,  # type: ignore
+            author=ctx.author,
+            project=ctx.project,
+            include_reported=True,
+        ),
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.delete_entries",
+        lambda ctx: entry.delete_entries(
+            ctx.con, author=ctx.author, project=ctx.project  # type: ignore
+        ),
+        mutates=True,
+        needs_connection=True,
+    ),
+    Benchmark(
+        "entry.report_entries",
+        lambda ctx: entry.report_entries(
+            ctx.con, author=ctx.author, project=ctx.project  # type: ignore
+        ),
+        mutates=True,
+        needs_connection=True,
+    ),
+]
+
+
+def busiest_target(path: pathlib.Path) -> tuple[str, str, int]:
+    """Return the author and project with most entries in the log, and the id of an
+    entry in the middle of the table.
+
+    Benchmarking against the busiest author and project gives the worst case for the
+    commands that filter the log.
+    """
+    con = db.get_connection(path)
+    try:
+        row = con.execute(
+            "SELECT author, project FROM entry GROUP BY author, project "
+            "ORDER BY COUNT(*) DESC, author, project LIMIT 1"
+        ).fetchone()
+        (max_id,) = con.execute("SELECT MAX(id) AS max_id FROM entry").fetchone()
+    finally:
+        con.close()
+    return row.author, row.project, max(1, max_id // 2)
+
+
+def git_revision() -> Optional[str]:
+    """Return the short hash of the current git commit, if available"""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=pathlib.Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def max_rss() -> Optional[int]:
+    """Return the maximum resident set size of the process so far, in bytes"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_once(
+    bench: Benchmark, ctx: Context, template: pathlib.Path, trace_memory: bool
+) -> tuple[float, int]:
+    """Run a benchmark once from a fresh copy of the log, returning the elapsed
+    time in seconds and the peak memory in bytes (0 if `trace_memory` is `False`)
+    """
+    if bench.mutates or not ctx.db_path.exists():
+        shutil.copyfile(template, ctx.db_path)
+    if bench.needs_connection:
+        ctx.con = db.get_connection(ctx.db_path)
+
+    peak = 0
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            bench.func(ctx)
+            elapsed = time.perf_counter() - start
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        if ctx.con is not None:
+            ctx.con.close()
+            ctx.con = None
+    return elapsed, peak
+
+
+def _rss_child(bench: Benchmark, ctx: Context, template: pathlib.Path, conn):
+    """Entry point of the child process used by `measure_rss`"""
+    try:
+        before = max_rss()
+        run_once(bench, ctx, template, trace_memory=False)
+        after = max_rss()
+        conn.send((after, after - before))  # type: ignore
+    except BaseException as e:
+        conn.send(f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+def measure_rss(
+    bench: Benchmark, ctx: Context, template: pathlib.Path
+) -> tuple[Optional[int], Optional[int]]:
+    """Run a benchmark in a forked child process, returning the maximum resident set
+    size of the child and how much it grew during the benchmark, in bytes.
+
+    Running in a child process isolates the measurement from the previous benchmarks
+    and the log generation. Returns `None`s if the platform does not support it.
+    """
+    if resource is None or "fork" not in multiprocessing.get_all_start_methods():
+        return None, None
+
+    mp = multiprocessing.get_context("fork")
+    recv_conn, send_conn = mp.Pipe(duplex=False)
+    process = mp.Process(target=_rss_child, args=(bench, ctx, template, send_conn))
+    process.start()
+    send_conn.close()
+    try:
+        result = recv_conn.recv()
+    except EOFError:
+        result = f"child process exited with code {process.exitcode}"
+    finally:
+        recv_conn.close()
+        process.join()
+    if isinstance(result, str):
+        raise RuntimeError(f"{bench.name} failed while measuring memory: {result}")
+    return result
+
+
+def run_size(
+    size: int,
+    benchmarks: list[Benchmark],
+    *,
+    repeat: int,
+    seed: int,
+    workdir: pathlib.Path,
+    console: Console,
+) -> list[Result]:
+    """Run all the `benchmarks` against a synthetic log with `size` entries"""
+    template = workdir / f"template-{size}-{seed}.db"
+    if not template.exists():
+        console.log(f"Generating log with {size} entries")
+        generate.create_log(template, size, seed=seed)
+    author, project, entry_id = busiest_target(template)
+    ctx = Context(
+        db_path=setup.default_db_path(),
+        template=template,
+        author=author,
+        project=project,
+        entry_id=entry_id,
+    )
+
+    results = []
+    for bench in benchmarks:
+        console.log(f"Running {bench.name} with {size} entries")
+        if ctx.db_path.exists():
+            ctx.db_path.unlink()
+        result = Result(name=bench.name, size=size)
+        for _ in range(repeat):
+            elapsed, _ = run_once(bench, ctx, template, trace_memory=False)
+            result.times.append(elapsed)
+        # Measure memory in separate runs, since `tracemalloc` slows everything down
+        _, result.peak_memory = run_once(bench, ctx, template, trace_memory=True)
+        result.max_rss, result.rss_growth = measure_rss(bench, ctx, template)
+        results.append(result)
+    return results
+
+
+def run(args: argparse.Namespace) -> int:
+    console = Console(stderr=True)
+    benchmarks = [
+        b
+        for b in BENCHMARKS
+        if not args.filter or any(f in b.name for f in args.filter)
+    ]
+    if not benchmarks:
+        console.print(f"No benchmarks match {args.filter!r}")
+        return 1
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="pal-bench-") as tmp:
+        workdir = pathlib.Path(args.cache_dir or tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+
+        # Point PAL to a temporary directory so the handlers use a scratch DB
+        data_home = pathlib.Path(tmp) / "data"
+        data_home.mkdir()
+        old_data_home = os.environ.get("XDG_DATA_HOME")
+        os.environ["XDG_DATA_HOME"] = str(data_home)
+        setup.ensure_setup()
+        try:
+            for size in args.sizes:
+                results.extend(
+                    run_size(
+                        size,
+                        benchmarks,
+                        repeat=args.repeat,
+                        seed=args.seed,
+                        workdir=workdir,
+                        console=console,
+                    )
+                )
+        finally:
+            if old_data_home is None:
+                del os.environ["XDG_DATA_HOME"]
+            else:
+                os.environ["XDG_DATA_HOME"] = old_data_home
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "pal_version": __version__,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "date": datetime.datetime.now().astimezone().isoformat(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "memory": {
+                "peak_memory": "peak of the Python allocations during the benchmark "
+                "(tracemalloc), excluding SQLite's page cache and sort memory",
+                "max_rss": "maximum resident set size, in bytes, of a child process "
+                "forked to run only the benchmark (includes the memory of the "
+                "runner at the time of the fork)",
+                "rss_growth": "growth of the maximum resident set size of that "
+                "child process during the benchmark, in bytes (includes SQLite)",
+            },
+        },
+        "results": [r.to_json() for r in results],
+    }
+
+    output = pathlib.Path(
+        args.output or DEFAULT_RESULTS_DIR / f"{revision or 'unknown'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    console.print(f"Results written to {output}")
+
+    table = Table(title=f"PAL benchmarks ({revision or 'unknown revision'})")
+    table.add_column("benchmark", no_wrap=True)
+    table.add_column("entries", justify="right")
+    table.add_column("median (ms)", justify="right", style="yellow")
+    table.add_column("min (ms)", justify="right")
+    table.add_column("peak memory (KiB)", justify="right", style="green")
+    for r in results:
+        table.add_row(
+            escape(r.name),
+            str(r.size),
+            f"{statistics.median(r.times) * 1000:.2f}",
+            f"{min(r.times) * 1000:.2f}",
+            f"{r.peak_memory / 1024:.1f}",
+        )
+    console.print(table)
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Compare the median times of two result files.
+
+    Returns 1 if any benchmark is slower than the baseline by more than the
+    threshold, so it can be used to detect regressions in scripts.
+    """
+    console = Console()
+    base = json.loads(pathlib.Path(args.base).read_text())
+    new = json.loads(pathlib.Path(args.new).read_text())
+    base_results = {(r["name"], r["size"]): r for r in base["results"]}
+
+    table = Table(
+        title=f"{base['meta']['revision']} -> {new['meta']['revision']}",
+    )
+    table.add_column("benchmark", no_wrap=True)
+    table.add_column("entries", justify="right")
+    table.add_column("base (ms)", justify="right")
+    table.add_column("new (ms)", justify="right")
+    table.add_column("ratio", justify="right")
+    table.add_column("peak memory ratio", justify="right")
+    table.add_column("RSS growth ratio", justify="right")
+
+    regressions = 0
+    for r in new["results"]:
+        b = base_results.get((r["name"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["median"] / b["median"] if b["median"] else float("inf")
+        memory_ratio = (
+            r["peak_memory"] / b["peak_memory"] if b["peak_memory"] else float("inf")
+        )
+        # Older result files do not have the RSS measurements
+        base_rss, new_rss = b.get("rss_growth"), r.get("rss_growth")
+        if base_rss and new_rss is not None:
+            rss_ratio = f"{new_rss / base_rss:.2f}x"
+        else:
+            rss_ratio = "-"
+        if ratio > 1 + args.threshold:
+            regressions += 1
+            style = "red"
+        elif ratio < 1 - args.threshold:
+            style = "green"
+        else:
+            style = ""
+        table.add_row(
+            escape(r["name"]),
+            str(r["size"]),
+            f"{b['median'] * 1000:.2f}",
+            f"{r['median'] * 1000:.2f}",
+            f"[{style}]{ratio:.2f}x[/{style}]" if style else f"{ratio:.2f}x",
+            f"{memory_ratio:.2f}x",
+            rss_ratio,
+        )
+    console.print(table)
+
+    if regressions:
+        console.print(
+            f"{regressions} benchmarks are more than {args.threshold:.0%} slower"
+        )
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PAL benchmarks")
+    subparser = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    run_parser = subparser.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "-s",
+        "--sizes",
+        help="Number of entries in the log for each round of benchmarks",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+    )
+    run_parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Number of timed runs per benchmark",
+        type=int,
+        default=DEFAULT_REPEAT,
+    )
+    run_parser.add_argument(
+        "--seed",
+        help="Seed for the log generator",
+        type=int,
+        default=generate.DEFAULT_SEED,
+    )
+    run_parser.add_argument(
+        "-k",
+        "--filter",
+        help="Only run the benchmarks whose name contains any of these strings",
+        nargs="+",
+        default=None,
+    )
+    run_parser.add_argument(
+        "-o",
+        "--output",
+        help="JSON file for the results (default: benchmarks/results/<revision>.json)",
+        default=None,
+    )
+    run_parser.add_argument(
+        "--cache-dir",
+        help="Directory to keep the generated logs between runs",
+        default=None,
+    )
+
+    compare_parser = subparser.add_parser(
+        "compare", help="Compare two benchmark result files"
+    )
+    compare_parser.add_argument("base", help="Baseline results file")
+    compare_parser.add_argument("new", help="New results file")
+    compare_parser.add_argument(
+        "-t",
+        "--threshold",
+        help="Relative slowdown considered a regression",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    elif args.command == "compare":
+        sys.exit(compare(args))
+    else:
+        raise ValueError(f"invalid command {args.command!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
+import time
+
 __version__ = "0.0.2"
+
+# Reference point to measure the import time of PAL when tracing is enabled
+_import_started = time.perf_counter()
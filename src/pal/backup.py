@@ -0,0 +1,257 @@
+"""Online backups of the PAL database.
+
+Backups use the SQLite backup API, copying a few pages at a time and sleeping
+between the steps, so that other `pal` processes writing to the log are never
+blocked for long.
+
+When another process writes to the log during a backup, SQLite restarts the copy from
+the beginning. A backup that is restarted more than `max_restarts` times (which can
+happen with a steady stream of writes) is abandoned with a `BackupError`.
+"""
+from __future__ import annotations
+
+import contextlib
+import datetime
+import gzip
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Iterator, Optional
+
+from pal import db
+from pal.utils import dates
+
+DEFAULT_BACKUP_PAGES = 128
+DEFAULT_BACKUP_SLEEP = 0.01
+DEFAULT_MAX_RESTARTS = 10
+SNAPSHOT_PREFIX = "pal-"
+SNAPSHOT_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S-%fZ"
+SNAPSHOT_PATTERN = re.compile(r"^pal-\d{8}T\d{6}-\d{6}Z\.db(\.gz)?$")
+GZIP_SUFFIX = ".gz"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class BackupError(Exception):
+    """An error raised while backing up or restoring the PAL database"""
+
+    pass
+
+
+def snapshot_name(
+    timestamp: Optional[datetime.datetime] = None, compress: bool = False
+) -> str:
+    """Return the file name of a snapshot taken at `timestamp` (now by default).
+
+    The names use UTC, so they sort in chronological order regardless of DST or
+    timezone changes.
+    """
+    timestamp = (timestamp or dates.current_time()).astimezone(datetime.timezone.utc)
+    name = f"{SNAPSHOT_PREFIX}{timestamp.strftime(SNAPSHOT_TIMESTAMP_FORMAT)}.db"
+    return name + GZIP_SUFFIX if compress else name
+
+
+def list_snapshots(directory: pathlib.Path) -> list[pathlib.Path]:
+    """Return the snapshots in `directory`, from oldest to newest"""
+    if not directory.is_dir():
+        return []
+    return sorted(
+        p for p in directory.iterdir() if SNAPSHOT_PATTERN.match(p.name) and p.is_file()
+    )
+
+
+def rotate_snapshots(directory: pathlib.Path, keep: int) -> list[pathlib.Path]:
+    """Remove all but the `keep` most recent snapshots in `directory`.
+
+    Only the files named like snapshots are considered. Returns the removed files
+    """
+    if keep < 1:
+        raise BackupError(f"at least one snapshot must be kept, got {keep}")
+    removed = list_snapshots(directory)[:-keep]
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def database_path(con: sqlite3.Connection) -> Optional[pathlib.Path]:
+    """Return the path of the main database file of `con` (`None` if in memory)"""
+    for row in con.execute("PRAGMA database_list").fetchall():
+        # Each row is (seq, name, file)
+        if row[1] == "main":
+            return pathlib.Path(row[2]).resolve() if row[2] else None
+    return None
+
+
+def backup_db(
+    con: sqlite3.Connection,
+    dest: pathlib.Path,
+    *,
+    pages: int = DEFAULT_BACKUP_PAGES,
+    sleep: float = DEFAULT_BACKUP_SLEEP,
+    compress: bool = False,
+    max_restarts: int = DEFAULT_MAX_RESTARTS,
+) -> pathlib.Path:
+    """Copy the database at `con` into `dest`, while it is being used.
+
+    The copy is done `pages` pages at a time, sleeping `sleep` seconds between the
+    steps so concurrent writers can make progress. The backup is written to a
+    temporary file next to `dest` which replaces it at the end, so `dest` is never
+    left half written. If `compress` is `True`, the result is compressed with gzip.
+
+    Writes from other connections restart the copy, and the backup fails if it is
+    restarted more than `max_restarts` times.
+    """
+    if pages < 1:
+        raise BackupError(f"the number of pages per step must be positive: {pages}")
+    if max_restarts < 0:
+        raise BackupError(
+            f"the number of restarts must not be negative: {max_restarts}"
+        )
+    source_path = database_path(con)
+    if source_path is not None and (
+        dest.resolve() == source_path or (dest.exists() and dest.samefile(source_path))
+    ):
+        raise BackupError(f"cannot back up the database onto itself: {dest}")
+
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal restarts, last_remaining
+        # SQLite starts over when the source is modified by another connection
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupError(
+                    f"backup restarted more than {max_restarts} times because of "
+                    "concurrent writes, try again later"
+                )
+        last_remaining = remaining
+        if remaining:
+            time.sleep(sleep)
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{dest.name}.", dir=dest.parent)
+    os.close(fd)
+    tmp = pathlib.Path(tmp_name)
+    try:
+        target = sqlite3.connect(str(tmp))
+        try:
+            con.backup(target, pages=pages, progress=progress)
+        finally:
+            target.close()
+
+        if compress:
+            compressed = tmp.with_name(tmp.name + GZIP_SUFFIX)
+            try:
+                with open(tmp, "rb") as src, gzip.open(compressed, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            except BaseException:
+                compressed.unlink(missing_ok=True)
+                raise
+            tmp.unlink()
+            tmp = compressed
+
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return dest
+
+
+def create_snapshot(
+    con: sqlite3.Connection,
+    directory: pathlib.Path,
+    *,
+    keep: Optional[int] = None,
+    pages: int = DEFAULT_BACKUP_PAGES,
+    sleep: float = DEFAULT_BACKUP_SLEEP,
+    compress: bool = False,
+    max_restarts: int = DEFAULT_MAX_RESTARTS,
+) -> pathlib.Path:
+    """Back up the database at `con` into a new timestamped snapshot in `directory`.
+
+    If `keep` is given, only the `keep` most recent snapshots are kept afterwards
+    """
+    if keep is not None and keep < 1:
+        raise BackupError(f"at least one snapshot must be kept, got {keep}")
+    dest = directory / snapshot_name(compress=compress)
+    backup_db(
+        con,
+        dest,
+        pages=pages,
+        sleep=sleep,
+        compress=compress,
+        max_restarts=max_restarts,
+    )
+    if keep is not None:
+        rotate_snapshots(directory, keep)
+    return dest
+
+
+def is_compressed(path: pathlib.Path) -> bool:
+    """Return `True` if the file at `path` is compressed with gzip"""
+    with open(path, "rb") as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def check_snapshot(con: sqlite3.Connection):
+    """Make sure that the database at `con` is a valid PAL database that can be
+    restored with the current schema
+    """
+    try:
+        (result,) = con.execute("PRAGMA quick_check").fetchone()
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"snapshot is not a valid database: {e}") from e
+    if result != "ok":
+        raise BackupError(f"snapshot is corrupted: {result}")
+
+    version = db.get_schema_version(con)
+    if version == 0:
+        raise BackupError("snapshot is not a PAL database")
+    if version != db.SCHEMA_VERSION:
+        raise BackupError(
+            f"snapshot has schema version {version}, but version "
+            f"{db.SCHEMA_VERSION} is required"
+        )
+
+
+@contextlib.contextmanager
+def open_snapshot(snapshot: pathlib.Path) -> Iterator[sqlite3.Connection]:
+    """Open the `snapshot` (optionally compressed with gzip) read only, after
+    checking that it can be restored
+    """
+    if not snapshot.is_file():
+        raise BackupError(f"snapshot does not exist: {snapshot}")
+
+    with tempfile.TemporaryDirectory(prefix="pal-restore-") as tmp:
+        if is_compressed(snapshot):
+            path = pathlib.Path(tmp) / "snapshot.db"
+            try:
+                with gzip.open(snapshot, "rb") as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            except (OSError, EOFError) as e:
+                raise BackupError(f"could not decompress snapshot: {e}") from e
+        else:
+            path = snapshot
+
+        # Open the snapshot read only, to leave it untouched
+        source = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            check_snapshot(source)
+            yield source
+        finally:
+            source.close()
+
+
+def restore_db(con: sqlite3.Connection, snapshot: pathlib.Path):
+    """Replace the contents of the database at `con` with the `snapshot`.
+
+    The snapshot is checked before anything is modified. The contents are swapped in
+    a single SQLite transaction, so the other connections see either the old or the
+    new database, never a mix of both.
+    """
+    with open_snapshot(snapshot) as source:
+        source.backup(con)
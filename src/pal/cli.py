@@ -3,13 +3,18 @@ from __future__ import annotations
 import argparse
 import datetime
 import os
+import pathlib
+import sqlite3
+import sys
+import time
 from enum import Enum
 from typing import Optional
 
 from rich.console import Console
 from rich.table import Table
 
-from pal import __version__, db, models, setup
+import pal
+from pal import __version__, backup, db, models, setup, trace
 from pal.models import entry
 from pal.utils import interact
 
@@ -17,6 +22,8 @@ PAL_COMMAND_COMMIT = "commit"
 PAL_COMMAND_LOG = "log"
 PAL_COMMAND_CLEAN = "clean"
 PAL_COMMAND_REPORT = "report"
+PAL_COMMAND_BACKUP = "backup"
+PAL_COMMAND_RESTORE = "restore"
 
 
 class OutputFormat(str, Enum):
@@ -26,14 +33,17 @@ class OutputFormat(str, Enum):
     JSON = "json"
 
 
-def init_db():
-    """Initialize the Database with all the required tables"""
-    # TODO(alvaro): We should check that the schema is the correct one...
-    # although that would be heavy... maybe we can query the version of the DB
-    # schema in some way, and have some migration path ready
+@trace.timed()
+def init_db(con: Optional[sqlite3.Connection] = None):
+    """Initialize the Database with all the required tables.
+
+    If no `con` is given, the default database is used
+    """
+    # TODO(alvaro): We should check that the schema version is the correct one,
+    # and have some migration path ready
 
     # Create the entry table
-    con = db.get_connection()
+    con = con or db.get_connection()
     with con:
         con.execute(
             """
@@ -49,6 +59,10 @@ def init_db():
             );
             """
         )
+        # Only write the version when missing, to avoid a write on every command
+        (version,) = con.execute("PRAGMA user_version").fetchone()
+        if version == 0:
+            con.execute(f"PRAGMA user_version = {db.SCHEMA_VERSION}")
 
 
 def request_confirmation_delete(author: str, project: Optional[str]) -> bool:
@@ -60,6 +74,12 @@ def request_confirmation_delete(author: str, project: Optional[str]) -> bool:
     return interact.ask_for_confirmation(msg)
 
 
+def request_confirmation_restore(snapshot: pathlib.Path) -> bool:
+    """Request confirmation from the user for restore action"""
+    msg = f"Replace all the entries with the contents of '{snapshot}'?"
+    return interact.ask_for_confirmation(msg)
+
+
 def request_confirmation_report(author: str, project: Optional[str]) -> bool:
     """Request confirmation from the user for report action"""
     if project is None:
@@ -87,7 +107,8 @@ def create_entry(
 
     # Actually insert the entry
     con = db.get_connection()
-    inserted = entry.insert_entry(con, e)
+    with trace.phase("query"):
+        inserted = entry.insert_entry(con, e)
 
     return inserted
 
@@ -104,9 +125,21 @@ def display_entries(
 
     # Find the entries
     con = db.get_connection()
-    entries = entry.find_entries(
-        con, author=author, project=project, include_reported=include_reported
-    )
+    with trace.phase("query"):
+        entries = entry.find_entries(
+            con, author=author, project=project, include_reported=include_reported
+        )
+
+    with trace.phase("render"):
+        render_entries(entries, format=format, include_reported=include_reported)
+
+
+def render_entries(
+    entries: list[models.Entry],
+    format: OutputFormat = OutputFormat.RICH,
+    include_reported: bool = False,
+):
+    """Print the entries in the requested format"""
 
     if format == OutputFormat.JSON:
         import json
@@ -145,7 +178,8 @@ def delete_entries(author: str, project: Optional[str]):
 
     # Find the entries
     con = db.get_connection()
-    deleted = entry.delete_entries(con, author=author, project=project)
+    with trace.phase("query"):
+        deleted = entry.delete_entries(con, author=author, project=project)
     print(f"{deleted} entries deleted")
 
 
@@ -157,7 +191,8 @@ def report_entries(author: str, project: Optional[str]):
 
     # Find the entries
     con = db.get_connection()
-    reported = entry.report_entries(con, author=author, project=project)
+    with trace.phase("query"):
+        reported = entry.report_entries(con, author=author, project=project)
     print(f"{reported} entries marked as reported")
 
 
@@ -287,7 +322,83 @@ def handle_commit(text: str, author: Optional[str], project: Optional[str]):
     create_entry(text, author=actual_author, project=actual_project)
 
 
+def handle_backup(
+    dest: Optional[str],
+    keep: Optional[int] = None,
+    compress: bool = False,
+    pages: int = backup.DEFAULT_BACKUP_PAGES,
+    sleep: float = backup.DEFAULT_BACKUP_SLEEP,
+    max_restarts: int = backup.DEFAULT_MAX_RESTARTS,
+):
+    """Handle the `backup` command for PAL.
+
+    A new timestamped snapshot is created in the `dest` directory (created if needed)
+    when `dest` is an existing directory, ends with a path separator or `keep` is
+    given, keeping only the `keep` most recent snapshots. If no `dest` is given, the
+    default backup directory is used. Otherwise the backup is written to the `dest`
+    file.
+    """
+
+    # Make sure PAL is setup
+    setup.ensure_setup()
+
+    # Prepare the DB for use
+    init_db()
+
+    dest_path = pathlib.Path(dest) if dest else setup.default_backup_directory()
+    separators = tuple(sep for sep in (os.sep, os.altsep) if sep)
+    is_directory = (
+        dest is None
+        or dest.endswith(separators)
+        or keep is not None
+        or dest_path.is_dir()
+    )
+    if is_directory and dest_path.exists() and not dest_path.is_dir():
+        raise backup.BackupError(f"not a directory: {dest_path}")
+
+    con = db.get_connection()
+    with trace.phase("backup"):
+        if is_directory:
+            path = backup.create_snapshot(
+                con,
+                dest_path,
+                keep=keep,
+                pages=pages,
+                sleep=sleep,
+                compress=compress,
+                max_restarts=max_restarts,
+            )
+        else:
+            path = backup.backup_db(
+                con,
+                dest_path,
+                pages=pages,
+                sleep=sleep,
+                compress=compress,
+                max_restarts=max_restarts,
+            )
+    print(f"Backup written to {path}")
+
+
+def handle_restore(snapshot: str, auto_yes: bool = False):
+    """Handle the `restore` command for PAL"""
+
+    # Make sure PAL is setup
+    setup.ensure_setup()
+
+    snapshot_path = pathlib.Path(snapshot)
+
+    # Check the snapshot before asking for confirmation
+    with backup.open_snapshot(snapshot_path) as source:
+        if auto_yes or request_confirmation_restore(snapshot_path):
+            con = db.get_connection()
+            with trace.phase("restore"):
+                source.backup(con)
+            print(f"Restored from {snapshot_path}")
+
+
 def main():
+    main_started = time.perf_counter()
     parser = argparse.ArgumentParser()
 
     # Global options
@@ -303,6 +414,12 @@ def main():
         help="Show the full path to the DB file and exit",
         action="store_true",
     )
+    parser.add_argument(
+        "--timings",
+        help="Report the timings and SQL statements of the command to stderr "
+        "(also enabled with the $PAL_TRACE environment variable)",
+        action="store_true",
+    )
 
     subparser = parser.add_subparsers(dest="command", metavar="command")
 
@@ -352,10 +469,59 @@ def main():
         "-y", "--yes", help="Skip confirmation prompt", action="store_true"
     )
 
+    # Prepare the backup command
+    backup_parser = subparser.add_parser(
+        PAL_COMMAND_BACKUP, help="Back up the log while it is in use"
+    )
+    backup_parser.add_argument(
+        "dest",
+        help="File to write the backup to, or directory to create a timestamped "
+        "snapshot in (default: the `backups` directory inside the PAL directory)",
+        nargs="?",
+        default=None,
+    )
+    backup_parser.add_argument(
+        "-k",
+        "--keep",
+        help="Keep only this number of most recent snapshots in the directory "
+        "(`dest` is always considered a directory with this option)",
+        type=int,
+        default=None,
+    )
+    backup_parser.add_argument(
+        "-z", "--compress", help="Compress the backup with gzip", action="store_true"
+    )
+    backup_parser.add_argument(
+        "--pages",
+        help="Number of pages copied on each step of the backup",
+        type=int,
+        default=backup.DEFAULT_BACKUP_PAGES,
+    )
+    backup_parser.add_argument(
+        "--sleep",
+        help="Seconds to sleep between the steps of the backup",
+        type=float,
+        default=backup.DEFAULT_BACKUP_SLEEP,
+    )
+    backup_parser.add_argument(
+        "--max-restarts",
+        help="Give up if concurrent writes restart the backup more than this "
+        "number of times",
+        type=int,
+        default=backup.DEFAULT_MAX_RESTARTS,
+    )
+
+    # Prepare the restore command
+    restore_parser = subparser.add_parser(
+        PAL_COMMAND_RESTORE, help="Replace the log with a backup"
+    )
+    restore_parser.add_argument("snapshot", help="Backup file to restore")
+    restore_parser.add_argument(
+        "-y", "--yes", help="Skip confirmation prompt", action="store_true"
+    )
+
     args = parser.parse_args()  # noqa: F841
     command = args.command
-    author_arg = args.author
-    project_arg = args.project
     show_db = args.show_db
 
     if show_db:
@@ -365,7 +531,41 @@ def main():
     # Handle implicit command
     command = command or PAL_COMMAND_LOG
 
-    # Run the command
+    trace_format = trace.format_from_env()
+    if args.timings and trace_format is None:
+        trace_format = trace.TraceFormat.TEXT
+
+    try:
+        if trace_format is None:
+            run_command(command, args)
+        else:
+            run_traced_command(command, args, trace_format, main_started)
+    except backup.BackupError as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+
+
+def run_traced_command(
+    command: str,
+    args: argparse.Namespace,
+    trace_format: trace.TraceFormat,
+    main_started: float,
+):
+    """Run the `command` with tracing enabled, and report the trace to stderr"""
+    tracer = trace.enable()
+    tracer.add_phase("import", start=pal._import_started, end=main_started)
+    try:
+        with tracer.phase(command):
+            run_command(command, args)
+    finally:
+        trace.disable()
+        tracer.report(trace_format, file=sys.stderr)
+
+
+def run_command(command: str, args: argparse.Namespace):
+    """Run the `command` with the parsed CLI `args`"""
+    author_arg = args.author
+    project_arg = args.project
+
     if command == PAL_COMMAND_LOG:
         # If the log command is implicit, we don't have the arguments
         json = getattr(args, "json", False)
@@ -387,5 +587,16 @@ def main():
         all = args.all
         yes = args.yes
         handle_report(author=author_arg, project=project_arg, all=all, auto_yes=yes)
+    elif command == PAL_COMMAND_BACKUP:
+        handle_backup(
+            args.dest,
+            keep=args.keep,
+            compress=args.compress,
+            pages=args.pages,
+            sleep=args.sleep,
+            max_restarts=args.max_restarts,
+        )
+    elif command == PAL_COMMAND_RESTORE:
+        handle_restore(args.snapshot, auto_yes=args.yes)
     else:
         raise ValueError(f"invalid command {command!r}")
@@ -6,9 +6,12 @@ import pathlib
 import sqlite3
 from collections import namedtuple
 
-from pal import setup
+from pal import setup, trace
 from pal.utils import dates
 
+# Version of the DB schema, stored in the `user_version` of the DB
+SCHEMA_VERSION = 1
+
 
 # Register adapters and converters
 def adapt_datetime(value: datetime.datetime) -> str:
@@ -42,6 +45,31 @@ def namedtuple_factory(cursor, row):
 def get_connection(path: str | pathlib.Path | None = None) -> sqlite3.Connection:
     """Get a `sqlite3.Connection` to the default database"""
     db_path = path or setup.default_db_path()
-    con = sqlite3.connect(str(db_path), detect_types=sqlite3.PARSE_DECLTYPES)
+    tracer = trace.get_tracer()
+    if tracer is None:
+        con = sqlite3.connect(str(db_path), detect_types=sqlite3.PARSE_DECLTYPES)
+    else:
+        con = sqlite3.connect(
+            str(db_path),
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=trace.TracingConnection,
+        )
+        con.tracer = tracer
+        tracer.attach(con, db_path)
     con.row_factory = namedtuple_factory
     return con
+
+
+def get_schema_version(con: sqlite3.Connection) -> int:
+    """Return the version of the PAL schema of the database at `con`.
+
+    Databases created before the schema was versioned are considered version 1, and
+    databases without PAL tables are version 0.
+    """
+    (version,) = con.execute("PRAGMA user_version").fetchone()
+    if version == 0:
+        row = con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'entry'"
+        ).fetchone()
+        return 1 if row is not None else 0
+    return int(version)
@@ -6,6 +6,7 @@ import sqlite3
 from dataclasses import asdict, dataclass
 from typing import Optional
 
+from pal import trace
 from pal.utils import dates
 
 
@@ -121,11 +122,12 @@ def find_entries(
     query = query.format(filter=include_reported_fmt, limit=limit_fmt)
 
     cur.execute(query, params)
-    rows = cur.fetchall()
-    # Transform into an Entry instance
-    # TODO(alvaro): Use the builtin methods for automatically converting the results
-    # into an Entry instance (see converters)
-    entries = [Entry(**row._asdict()) for row in rows]
+    with trace.phase("decode"):
+        rows = cur.fetchall()
+        # Transform into an Entry instance
+        # TODO(alvaro): Use the builtin methods for automatically converting the
+        # results into an Entry instance (see converters)
+        entries = [Entry(**row._asdict()) for row in rows]
     return entries
 
 
@@ -4,7 +4,10 @@ from __future__ import annotations
 import os
 import pathlib
 
+from pal import trace
+
 DEFAULT_DB_FILENAME = "pal.db"
+DEFAULT_BACKUP_DIRNAME = "backups"
 
 
 class SetupError(Exception):
@@ -13,6 +16,7 @@ class SetupError(Exception):
     pass
 
 
+@trace.timed()
 def ensure_setup():
     """Ensure that the basic setup is created.
 
@@ -48,3 +52,11 @@ def default_db_path(filename: str = DEFAULT_DB_FILENAME) -> pathlib.Path:
     The PAL db file is located inside the PAL directory, by default named `pal.db`.
     """
     return default_pal_directory() / filename
+
+
+def default_backup_directory() -> pathlib.Path:
+    """Return the default path for the directory with the backups of the PAL db.
+
+    The backup directory is the `backups` directory inside the PAL directory.
+    """
+    return default_pal_directory() / DEFAULT_BACKUP_DIRNAME
@@ -0,0 +1,410 @@
+"""Profiling and query instrumentation for PAL.
+
+Tracing is disabled by default, and it can be enabled with the `--timings` CLI flag
+or the `$PAL_TRACE` environment variable (`json` selects the JSON report). When
+enabled, it records:
+
+    - The time spent in each phase of the command (import, setup, queries, render...)
+    - Every SQL statement executed by SQLite (through `sqlite3` trace callbacks),
+      with its duration and row count
+    - The `EXPLAIN QUERY PLAN` of the statements slower than `$PAL_TRACE_SLOW_MS`
+
+When disabled, the instrumentation points are reduced to a global lookup.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, ContextManager, Iterator, Optional, TypeVar
+
+DEFAULT_SLOW_MS = 10.0
+# Statements for which it makes sense to request a query plan
+EXPLAINABLE_PREFIXES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class TraceFormat(str, Enum):
+    """Supported output formats for the trace report"""
+
+    TEXT = "text"
+    JSON = "json"
+
+
+@dataclass
+class Phase:
+    name: str
+    depth: int
+    start: float
+    end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+@dataclass
+class Statement:
+    sql: str
+    phase: Optional[str]
+    db_path: Optional[str]
+    start: float
+    end: Optional[float] = None
+    rows: Optional[int] = None
+    plan: Optional[list[str]] = None
+    # Time spent in the row factory, which is not part of the SQL time
+    decode: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, (self.end or self.start) - self.start - self.decode)
+
+
+@dataclass
+class Tracer:
+    """Collect the phases and SQL statements of a PAL invocation"""
+
+    slow_ms: float = DEFAULT_SLOW_MS
+    phases: list[Phase] = field(default_factory=list)
+    statements: list[Statement] = field(default_factory=list)
+    _stack: list[Phase] = field(default_factory=list)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        """Time the enclosed block as a phase named `name`"""
+        p = Phase(name=name, depth=len(self._stack), start=time.perf_counter())
+        self.phases.append(p)
+        self._stack.append(p)
+        try:
+            yield p
+        finally:
+            p.end = time.perf_counter()
+            self._stack.pop()
+            self.finish_statement()
+
+    def add_phase(self, name: str, start: float, end: float):
+        """Record a phase that was measured outside of the tracer"""
+        self.phases.append(
+            Phase(name=name, depth=len(self._stack), start=start, end=end)
+        )
+
+    def attach(self, con: sqlite3.Connection, db_path: str | pathlib.Path):
+        """Start recording the statements executed through `con`"""
+
+        def on_statement(sql: str):
+            now = time.perf_counter()
+            self.finish_statement(now)
+            phase = self._stack[-1].name if self._stack else None
+            self.statements.append(
+                Statement(sql=sql.strip(), phase=phase, db_path=str(db_path), start=now)
+            )
+
+        con.set_trace_callback(on_statement)
+
+    def finish_statement(self, now: Optional[float] = None):
+        """Mark the last statement as finished, if it was not finished already"""
+        if self.statements and self.statements[-1].end is None:
+            self.statements[-1].end = now or time.perf_counter()
+
+    def update_statement(
+        self, stmt: Statement, rows: int = 0, rowcount: Optional[int] = None
+    ):
+        """Register activity on `stmt`: `rows` fetched rows, or the `rowcount` of a
+        statement that does not return rows
+        """
+        if rowcount is not None:
+            stmt.rows = rowcount if rowcount >= 0 else None
+        else:
+            stmt.rows = (stmt.rows or 0) + rows
+        stmt.end = time.perf_counter()
+
+    def explain_slow_statements(self):
+        """Request the query plan for the statements slower than `slow_ms`"""
+        for stmt in self.statements:
+            if stmt.duration * 1000 < self.slow_ms or stmt.db_path is None:
+                continue
+            if not stmt.sql.upper().startswith(EXPLAINABLE_PREFIXES):
+                continue
+            # Open the DB read only, so it is not created if it is gone
+            uri = pathlib.Path(stmt.db_path).resolve().as_uri()
+            try:
+                con = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+            except sqlite3.Error as e:
+                stmt.plan = [f"could not explain the statement: {e}"]
+                continue
+            try:
+                rows = con.execute(f"EXPLAIN QUERY PLAN {stmt.sql}").fetchall()
+                stmt.plan = [row[-1] for row in rows]
+            except sqlite3.Error as e:
+                stmt.plan = [f"could not explain the statement: {e}"]
+            finally:
+                con.close()
+
+    def to_json(self) -> dict:
+        return {
+            "phases": [
+                {"name": p.name, "depth": p.depth, "duration_ms": p.duration * 1000}
+                for p in self.phases
+            ],
+            "statements": [
+                {
+                    "sql": s.sql,
+                    "phase": s.phase,
+                    "duration_ms": s.duration * 1000,
+                    "decode_ms": s.decode * 1000,
+                    "rows": s.rows,
+                    "plan": s.plan,
+                }
+                for s in self.statements
+            ],
+        }
+
+    def report(self, format: TraceFormat = TraceFormat.TEXT, file=None):
+        """Write the collected information to `file` (`stderr` by default)"""
+        file = file or sys.stderr
+        self.finish_statement()
+        self.explain_slow_statements()
+
+        if format == TraceFormat.JSON:
+            print(json.dumps(self.to_json()), file=file)
+        elif format == TraceFormat.TEXT:
+            self._report_text(file)
+        else:
+            raise ValueError(f"invalid trace format: {format!r}")
+
+    def _report_text(self, file):
+        from rich.console import Console
+        from rich.markup import escape
+        from rich.table import Table
+
+        console = Console(file=file)
+
+        phases = Table(title="Timings", title_justify="left")
+        phases.add_column("phase")
+        phases.add_column("ms", justify="right", style="yellow")
+        for p in self.phases:
+            phases.add_row("  " * p.depth + p.name, f"{p.duration * 1000:.2f}")
+        console.print(phases)
+
+        total_ms = sum(s.duration for s in self.statements) * 1000
+        statements = Table(
+            title=f"SQL ({len(self.statements)} statements, {total_ms:.2f} ms)",
+            title_justify="left",
+        )
+        statements.add_column("ms", justify="right", style="yellow")
+        statements.add_column("decode ms", justify="right")
+        statements.add_column("rows", justify="right")
+        statements.add_column("phase", style="green")
+        statements.add_column("statement", overflow="fold")
+        for s in self.statements:
+            statement = escape(" ".join(s.sql.split()))
+            if s.plan is not None:
+                statement += "".join(f"\n  [cyan]{escape(p)}[/cyan]" for p in s.plan)
+            statements.add_row(
+                f"{s.duration * 1000:.2f}",
+                f"{s.decode * 1000:.2f}" if s.decode else "",
+                "" if s.rows is None else str(s.rows),
+                s.phase or "",
+                statement,
+            )
+        console.print(statements)
+
+
+def traced_row_factory(factory: Callable) -> Callable:
+    """Wrap a row `factory` so its time is recorded as the decode time of the
+    statement of the cursor, instead of being counted as SQL time
+    """
+
+    def wrapper(cursor: sqlite3.Cursor, row: tuple):
+        start = time.perf_counter()
+        try:
+            return factory(cursor, row)
+        finally:
+            stmt = getattr(cursor, "_statement", None)
+            if stmt is not None:
+                stmt.decode += time.perf_counter() - start
+
+    return wrapper
+
+
+class TracingCursor(sqlite3.Cursor):
+    """A cursor that reports the rows of the executed statements to the tracer"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The statement executed by this cursor, to attribute the fetched rows
+        self._statement: Optional[Statement] = None
+
+    def _tracer(self) -> Optional[Tracer]:
+        return getattr(self.connection, "tracer", None)
+
+    def _execute(self, method: Callable, *args, **kwargs):
+        tracer = self._tracer()
+        n_statements = len(tracer.statements) if tracer is not None else 0
+        result = method(*args, **kwargs)
+        if tracer is None or len(tracer.statements) == n_statements:
+            self._statement = None
+            return result
+
+        # The statement run by the cursor is the last one, after any implicit BEGIN
+        self._statement = tracer.statements[-1]
+        if self.description is None:
+            tracer.update_statement(self._statement, rowcount=self.rowcount)
+        return result
+
+    def _after_fetch(self, rows: int):
+        tracer = self._tracer()
+        if tracer is not None and self._statement is not None:
+            tracer.update_statement(self._statement, rows=rows)
+
+    def execute(self, *args, **kwargs):
+        return self._execute(super().execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._execute(super().executemany, *args, **kwargs)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._after_fetch(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self._after_fetch(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._after_fetch(len(rows))
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._after_fetch(0)
+            raise
+        self._after_fetch(1)
+        return row
+
+
+class TracingConnection(sqlite3.Connection):
+    """A connection that routes every statement through a `TracingCursor`"""
+
+    tracer: Optional[Tracer] = None
+
+    def cursor(self, factory=None):  # type: ignore
+        cur = super().cursor(factory or TracingCursor)
+        # The row factory is only set on the cursor once it has been created
+        if cur.row_factory is not None:
+            cur.row_factory = traced_row_factory(cur.row_factory)
+        return cur
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def __exit__(self, *args):
+        # The transaction is committed (or rolled back) when leaving the context
+        result = super().__exit__(*args)
+        if self.tracer is not None:
+            self.tracer.finish_statement()
+        return result
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Return the active `Tracer`, or `None` if tracing is disabled"""
+    return _tracer
+
+
+def enable(slow_ms: Optional[float] = None) -> Tracer:
+    """Enable tracing for the rest of the process, returning the active `Tracer`.
+
+    If `slow_ms` is not given, it is read from `$PAL_TRACE_SLOW_MS`
+    """
+    global _tracer
+    if slow_ms is None:
+        slow_ms = slow_ms_from_env()
+    _tracer = Tracer(slow_ms=slow_ms)
+    return _tracer
+
+
+def slow_ms_from_env() -> float:
+    """Return the slow statement threshold in `$PAL_TRACE_SLOW_MS`.
+
+    Invalid values are ignored (with a warning), falling back to the default
+    """
+    value = os.environ.get("PAL_TRACE_SLOW_MS", "").strip()
+    if not value:
+        return DEFAULT_SLOW_MS
+    try:
+        return float(value)
+    except ValueError:
+        print(
+            f"pal: ignoring invalid $PAL_TRACE_SLOW_MS {value!r}, "
+            f"using {DEFAULT_SLOW_MS} ms",
+            file=sys.stderr,
+        )
+        return DEFAULT_SLOW_MS
+
+
+def disable():
+    """Disable tracing"""
+    global _tracer
+    _tracer = None
+
+
+def format_from_env() -> Optional[TraceFormat]:
+    """Return the trace format requested in `$PAL_TRACE`, or `None` if tracing was
+    not requested.
+
+    `json` selects the JSON format, and any other non-empty value (except `0`)
+    selects the text format.
+    """
+    value = os.environ.get("PAL_TRACE", "").strip().lower()
+    if value in ("", "0"):
+        return None
+    if value == TraceFormat.JSON.value:
+        return TraceFormat.JSON
+    return TraceFormat.TEXT
+
+
+def phase(name: str) -> ContextManager:
+    """Time the enclosed block as a phase named `name`, if tracing is enabled"""
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.phase(name)
+
+
+def timed(name: Optional[str] = None) -> Callable[[F], F]:
+    """Decorator to time every call to the function as a phase, if tracing is enabled.
+
+    The phase is named after the function, unless a `name` is given
+    """
+
+    def decorator(func: F) -> F:
+        phase_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.phase(phase_name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -0,0 +1,217 @@
+import contextlib
+import datetime
+import gzip
+import sqlite3
+import sys
+
+import pytest
+
+from pal import backup, cli, db
+from pal.models import entry
+from pal.utils import dates
+
+
+def insert(con, text):
+    entry.insert_entry(
+        con,
+        entry.Entry(
+            text=text,
+            author="me",
+            project="default",
+            timestamp=dates.current_time(),
+        ),
+    )
+
+
+@pytest.fixture
+def make_db():
+    """Create PAL databases with some entries, closing them after the test"""
+    connections = []
+
+    def make(path, texts):
+        con = db.get_connection(path)
+        connections.append(con)
+        cli.init_db(con)
+        for text in texts:
+            insert(con, text)
+        return con
+
+    yield make
+    for con in connections:
+        con.close()
+
+
+def texts(con):
+    return [e.text for e in entry.find_entries(con, author="me", project="default")]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_backup_and_restore(tmp_path, make_db, compress):
+    con = make_db(tmp_path / "pal.db", ["one", "two"])
+    dest = tmp_path / "backup.db"
+    backup.backup_db(con, dest, pages=1, sleep=0, compress=compress)
+    if compress:
+        with gzip.open(dest) as f:
+            assert f.read(16) == b"SQLite format 3\x00"
+
+    entry.delete_entries(con, author="me", project=None)
+    assert texts(con) == []
+
+    backup.restore_db(con, dest)
+    assert sorted(texts(con)) == ["one", "two"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["backup.db", "pal.db"]
+
+
+def test_snapshot_rotation(tmp_path, make_db):
+    con = make_db(tmp_path / "pal.db", ["one"])
+    directory = tmp_path / "backups"
+    created = [backup.create_snapshot(con, directory, keep=2) for _ in range(3)]
+    (directory / "notes.txt").write_text("not a snapshot")
+
+    assert backup.list_snapshots(directory) == created[1:]
+    assert (directory / "notes.txt").exists()
+
+
+def test_restore_rejects_other_schema_version(tmp_path, make_db):
+    con = make_db(tmp_path / "pal.db", ["one"])
+    snapshot = tmp_path / "snapshot.db"
+    other = make_db(snapshot, ["two"])
+    other.execute(f"PRAGMA user_version = {db.SCHEMA_VERSION + 1}")
+    other.close()
+
+    with pytest.raises(backup.BackupError, match="schema version"):
+        backup.restore_db(con, snapshot)
+    assert texts(con) == ["one"]
+
+
+def test_restore_rejects_non_pal_database(tmp_path, make_db):
+    con = make_db(tmp_path / "pal.db", ["one"])
+    snapshot = tmp_path / "snapshot.db"
+    with contextlib.closing(sqlite3.connect(snapshot)) as other:
+        other.execute("CREATE TABLE other (x)")
+
+    with pytest.raises(backup.BackupError, match="not a PAL database"):
+        backup.restore_db(con, snapshot)
+    assert texts(con) == ["one"]
+
+
+def test_backup_restarts_on_concurrent_writes(tmp_path, make_db, monkeypatch):
+    con = make_db(tmp_path / "pal.db", [f"entry {i} " * 50 for i in range(100)])
+    writer = make_db(tmp_path / "pal.db", [])
+    commits = []
+
+    def write_once(seconds):
+        # Another process logs an entry between two steps of the backup
+        if not commits:
+            insert(writer, "written during the backup")
+            commits.append(seconds)
+
+    monkeypatch.setattr(backup.time, "sleep", write_once)
+    dest = backup.backup_db(con, tmp_path / "backup.db", pages=1, max_restarts=1)
+    assert commits
+
+    with contextlib.closing(db.get_connection(dest)) as copy:
+        assert "written during the backup" in texts(copy)
+
+
+def test_backup_gives_up_after_restarts(tmp_path, make_db, monkeypatch):
+    con = make_db(tmp_path / "pal.db", [f"entry {i} " * 50 for i in range(100)])
+    writer = make_db(tmp_path / "pal.db", [])
+    monkeypatch.setattr(backup.time, "sleep", lambda _: insert(writer, "again"))
+
+    dest = tmp_path / "backup.db"
+    with pytest.raises(backup.BackupError, match="restarted more than 3 times"):
+        backup.backup_db(con, dest, pages=1, max_restarts=3)
+    assert list(tmp_path.iterdir()) == [tmp_path / "pal.db"]
+
+
+def test_backup_onto_itself_fails(tmp_path, make_db):
+    con = make_db(tmp_path / "pal.db", ["one"])
+    with pytest.raises(backup.BackupError, match="onto itself"):
+        backup.backup_db(con, tmp_path / "." / "pal.db")
+    assert texts(con) == ["one"]
+
+
+def test_snapshot_names_use_utc():
+    tz = datetime.timezone(datetime.timedelta(hours=2))
+    timestamp = datetime.datetime(2023, 10, 29, 2, 30, tzinfo=tz)
+    assert backup.snapshot_name(timestamp) == "pal-20231029T003000-000000Z.db"
+    assert backup.SNAPSHOT_PATTERN.match(backup.snapshot_name(compress=True))
+
+
+@pytest.fixture
+def pal_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    monkeypatch.setenv("PAL_AUTHOR", "me")
+    cli.handle_commit("one", author=None, project=None)
+    return tmp_path
+
+
+def test_cli_backup_to_file(pal_home):
+    dest = pal_home / "backup.db"
+    cli.handle_backup(str(dest))
+    assert dest.is_file()
+
+
+@pytest.mark.parametrize("trailing_separator, keep", [(True, None), (False, 2)])
+def test_cli_backup_to_new_directory(pal_home, trailing_separator, keep):
+    dest = pal_home / "backups"
+    cli.handle_backup(str(dest) + ("/" if trailing_separator else ""), keep=keep)
+    assert dest.is_dir()
+    assert len(backup.list_snapshots(dest)) == 1
+
+
+def test_cli_backup_to_existing_directory(pal_home):
+    dest = pal_home / "backups"
+    dest.mkdir()
+    for _ in range(3):
+        cli.handle_backup(str(dest), keep=2, compress=True)
+    snapshots = backup.list_snapshots(dest)
+    assert len(snapshots) == 2
+    assert all(backup.is_compressed(p) for p in snapshots)
+
+
+def test_cli_backup_default_directory(pal_home):
+    cli.handle_backup(None)
+    assert len(backup.list_snapshots(pal_home / "pal" / "backups")) == 1
+
+
+def test_cli_backup_keep_with_file_fails(pal_home):
+    dest = pal_home / "backup.db"
+    dest.write_text("not a directory")
+    with pytest.raises(backup.BackupError, match="not a directory"):
+        cli.handle_backup(str(dest), keep=2)
+
+
+def test_cli_backup_to_live_database_fails(pal_home):
+    with pytest.raises(backup.BackupError, match="onto itself"):
+        cli.handle_backup(str(pal_home / "pal" / "pal.db"))
+    with contextlib.closing(db.get_connection()) as con:
+        assert texts(con) == ["one"]
+
+
+def test_cli_restore_checks_before_confirmation(pal_home, monkeypatch):
+    def confirm(snapshot):
+        raise AssertionError("should not ask for confirmation")
+
+    monkeypatch.setattr(cli, "request_confirmation_restore", confirm)
+    snapshot = pal_home / "snapshot.db"
+    snapshot.write_text("not a database")
+    with pytest.raises(backup.BackupError, match="not a valid database"):
+        cli.handle_restore(str(snapshot))
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["restore", "-y", "missing.db"],
+        ["backup", "--pages", "0", "backup.db"],
+    ],
+)
+def test_cli_errors_exit_without_traceback(pal_home, monkeypatch, capsys, args):
+    monkeypatch.chdir(pal_home)
+    monkeypatch.setattr(sys, "argv", ["pal", *args])
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main()
+    assert exc_info.value.code == 1
+    assert capsys.readouterr().err.startswith("pal: error: ")
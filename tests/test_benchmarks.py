@@ -0,0 +1,42 @@
+import argparse
+import json
+
+import pytest
+
+from benchmarks import generate, run
+from pal import cli, db
+
+
+def test_generate_rows_is_deterministic():
+    rows = list(generate.generate_rows(100, seed=1))
+    assert len(rows) == 100
+    assert list(generate.generate_rows(100, seed=1)) == rows
+    assert list(generate.generate_rows(100, seed=2)) != rows
+
+
+def test_populate(tmp_path):
+    con = db.get_connection(tmp_path / "pal.db")
+    try:
+        cli.init_db(con)
+        assert generate.populate(con, 250, batch_size=100) == 250
+        (count,) = con.execute("SELECT COUNT(*) AS count FROM entry").fetchone()
+    finally:
+        con.close()
+    assert count == 250
+
+
+def write_results(path, median):
+    result = {"name": "cli.handle_log", "size": 1000, "peak_memory": 1000}
+    result["median"] = median
+    path.write_text(json.dumps({"meta": {"revision": path.stem}, "results": [result]}))
+    return str(path)
+
+
+@pytest.mark.parametrize("new_median, expected", [(0.15, 1), (0.11, 0), (0.05, 0)])
+def test_compare(tmp_path, new_median, expected):
+    args = argparse.Namespace(
+        base=write_results(tmp_path / "base.json", 0.1),
+        new=write_results(tmp_path / "new.json", new_median),
+        threshold=0.2,
+    )
+    assert run.compare(args) == expected
@@ -0,0 +1,152 @@
+import json
+import sys
+import time
+
+import pytest
+
+from pal import cli, db, trace
+from pal.models import entry
+from pal.utils import dates
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.enable(slow_ms=0)
+    yield tracer
+    trace.disable()
+
+
+def test_disabled_by_default():
+    assert trace.get_tracer() is None
+    with trace.phase("noop") as p:
+        assert p is None
+
+
+def test_records_phases_and_statements(tmp_path, tracer):
+    con = db.get_connection(tmp_path / "pal.db")
+    cli.init_db(con)
+    with trace.phase("query"):
+        for text in ("one", "two"):
+            entry.insert_entry(
+                con,
+                entry.Entry(
+                    text=text,
+                    author="me",
+                    project="default",
+                    timestamp=dates.current_time(),
+                ),
+            )
+        entries = entry.find_entries(con, author="me", project="default")
+    con.close()
+    assert len(entries) == 2
+
+    names = [p.name for p in tracer.phases]
+    assert names == ["init_db", "query", "decode"]
+    assert tracer.phases[2].depth == 1
+
+    select = [
+        s
+        for s in tracer.statements
+        if s.sql.startswith("SELECT * FROM entry WHERE author")
+    ]
+    assert len(select) == 1
+    assert select[0].rows == 2
+    assert select[0].phase == "query"
+    inserts = [s for s in tracer.statements if s.sql.startswith("INSERT")]
+    assert [s.rows for s in inserts] == [1, 1]
+
+
+def test_report_json(tmp_path, tracer, capsys):
+    con = db.get_connection(tmp_path / "pal.db")
+    cli.init_db(con)
+    entry.find_entries(con, author="me", project="default")
+    con.close()
+
+    tracer.report(trace.TraceFormat.JSON)
+    report = json.loads(capsys.readouterr().err)
+    select = report["statements"][-1]
+    assert select["rows"] == 0
+    # Every explainable statement is slow with a threshold of 0
+    # The wording of the plan depends on the SQLite version
+    assert any("SCAN" in line for line in select["plan"])
+
+
+def test_invalid_slow_ms_falls_back_to_default(monkeypatch):
+    monkeypatch.setenv("PAL_TRACE_SLOW_MS", "fast")
+    assert trace.slow_ms_from_env() == trace.DEFAULT_SLOW_MS
+    monkeypatch.setenv("PAL_TRACE_SLOW_MS", "2.5")
+    assert trace.slow_ms_from_env() == 2.5
+
+
+def test_explain_does_not_create_missing_db(tmp_path, tracer):
+    path = tmp_path / "pal.db"
+    con = db.get_connection(path)
+    cli.init_db(con)
+    entry.find_entries(con, author="me", project="default")
+    con.close()
+    path.unlink()
+
+    tracer.explain_slow_statements()
+    assert not path.exists()
+    assert tracer.statements[-1].plan[0].startswith("could not explain")
+
+
+def test_row_factory_time_is_not_sql_time(tmp_path, tracer):
+    def slow_factory(cursor, row):
+        time.sleep(0.01)
+        return row
+
+    con = db.get_connection(tmp_path / "pal.db")
+    con.row_factory = slow_factory
+    cur = con.execute("SELECT 1 AS x UNION ALL SELECT 2 UNION ALL SELECT 3")
+    assert len(cur.fetchall()) == 3
+    con.close()
+
+    stmt = tracer.statements[-1]
+    assert stmt.rows == 3
+    assert stmt.decode >= 0.03
+    assert stmt.duration < 0.01
+
+
+def test_rows_are_attributed_to_the_cursor_statement(tmp_path, tracer):
+    con = db.get_connection(tmp_path / "pal.db")
+    cli.init_db(con)
+    cur = con.execute("SELECT 1 AS x UNION ALL SELECT 2")
+    con.execute("SELECT 1 AS y").fetchall()
+    assert len(cur.fetchall()) == 2
+    con.close()
+
+    first, second = tracer.statements[-2:]
+    assert first.sql.startswith("SELECT 1 AS x")
+    assert first.rows == 2
+    assert second.rows == 1
+
+
+@pytest.fixture
+def pal_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    monkeypatch.setenv("PAL_AUTHOR", "me")
+    monkeypatch.delenv("PAL_TRACE", raising=False)
+    cli.handle_commit("one", author=None, project=None)
+    return tmp_path
+
+
+@pytest.mark.parametrize("trace_env", [None, "json"])
+def test_cli_timings(pal_home, monkeypatch, capsys, trace_env):
+    if trace_env:
+        monkeypatch.setenv("PAL_TRACE", trace_env)
+    monkeypatch.setattr(sys, "argv", ["pal", "--timings", "log", "--json"])
+    cli.main()
+    out, err = capsys.readouterr()
+
+    # `--timings` must not swallow the command that follows it
+    assert [e["text"] for e in json.loads(out)] == ["one"]
+    assert trace.get_tracer() is None
+    if trace_env == "json":
+        phases = [p["name"] for p in json.loads(err)["phases"]]
+        assert phases[:2] == ["import", "log"]
+        assert "decode" in phases
+    else:
+        assert "Timings" in err
+        assert "import" in err
+        assert "SELECT * FROM entry" in err